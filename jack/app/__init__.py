@@ -10,6 +10,7 @@ from flask_moment import Moment
 from flask_babel import Babel, lazy_gettext as _l
 from elasticsearch import Elasticsearch
 from config import Config
+from app.json_provider import OrjsonProvider
 
 
 def get_locale():
@@ -28,7 +29,9 @@ babel = Babel()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
     app.config.from_object(config_class)
+    app.jwt_key = app.config['SECRET_KEY'].encode('utf-8')
 
     db.init_app(app)
     migrate.init_app(app, db)
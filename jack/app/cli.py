@@ -1,6 +1,8 @@
 import os
 from flask import Blueprint
 import click
+from app import db
+from app.models import User
 
 bp = Blueprint('cli', __name__, cli_group=None)
 
@@ -37,4 +39,11 @@ def update():
 def compile():
     """Compile all languages."""
     if os.system('pybabel compile -d app/translations'):
-        raise RuntimeError('compile command failed')
\ No newline at end of file
+        raise RuntimeError('compile command failed')
+
+
+@bp.cli.command()
+def recount():
+    """Recompute the stored follower, following and post counts."""
+    User.refresh_counts()
+    db.session.commit()
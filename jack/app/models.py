@@ -1,16 +1,37 @@
 from datetime import datetime, timezone
-from hashlib import md5
+import base64
+from hashlib import md5, sha256
+import hmac
 import json
+import re
 from time import time
 from typing import Optional
+import orjson
 import sqlalchemy as sa
 import sqlalchemy.orm as so
-from flask import current_app
+from flask import current_app, g, has_app_context, url_for
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-import jwt
+from werkzeug.security import check_password_hash
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
 from app import db, login
 
+password_hasher = PasswordHasher()
+
+JWT_HEADER = base64.urlsafe_b64encode(
+    b'{"alg":"HS256","typ":"JWT"}').rstrip(b'=')
+B64URL_CHARS = re.compile(rb'[A-Za-z0-9_-]*')
+
+
+def b64url_encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=')
+
+
+def b64url_decode(data):
+    if not B64URL_CHARS.fullmatch(data):
+        raise ValueError('invalid base64url data')
+    return base64.urlsafe_b64decode(data + b'=' * (-len(data) % 4))
+
 
 followers = sa.Table(
     'followers',
@@ -18,47 +39,119 @@ followers = sa.Table(
     sa.Column('follower_id', sa.Integer, sa.ForeignKey('user.id'),
                         primary_key=True),
     sa.Column('followed_id', sa.Integer, sa.ForeignKey('user.id'),
-                        primary_key=True)
+                        primary_key=True),
+    sa.Index('ix_followers_followed_follower', 'followed_id', 'follower_id',
+             unique=True)
 )
 
+def fast_count(query, exact_threshold=1000):
+    if db.engine.dialect.name == 'postgresql':
+        compiled = query.compile(
+            db.engine, compile_kwargs={'render_postcompile': True})
+        plan = db.session.connection().exec_driver_sql(
+            'EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+        estimate = int(plan[0]['Plan']['Plan Rows'])
+        if estimate >= exact_threshold:
+            return estimate
+    return db.session.scalar(sa.select(sa.func.count()).select_from(
+        query.order_by(None).subquery()))
+
 class PaginatedAPIMixin(object):
     @staticmethod
-    def to_collection_dict(query, page, per_page, endpoint, **kwargs):
-        resources = db.paginate(query, page=page, per_page=per_page, error_out=False)
+    def to_collection_dict(query, page, per_page, endpoint, load_options=(),
+                           **kwargs):
+        page = max(page, 1)
+        if per_page < 1:
+            per_page = 20
+        items = db.session.scalars(
+            query.options(*load_options)
+            .limit(per_page + 1).offset((page - 1) * per_page)).all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        total = fast_count(query)
+        pages = -(-total // per_page)
+        base_url = url_for(endpoint, per_page=per_page, **kwargs)
         data = {
-            'items': [item.to_dict() for item in resources.items],
+            'items': [item.to_dict() for item in items],
             'meta': {
                 'page': page,
                 'per_page': per_page,
-                'total_pages': resources.pages,
-                'total_items': resources.total
+                'total_pages': pages,
+                'total_items': total
             },
             '_links': {
-                'self': url_for(endpoint, page=page, per_page=per_page, **kwargs),
-                'next': url_for(endpoint, page=page + 1, per_page=per_page,
-                                **kwargs) if resources.has_next else None,
-                'prev': url_for(endpoint, page=page - 1, per_page=per_page,
-                                **kwargs) if resources.has_prev else None,
+                'self': f'{base_url}&page={page}',
+                'next': f'{base_url}&page={page + 1}'
+                        if has_next else None,
+                'prev': f'{base_url}&page={page - 1}'
+                        if page > 1 else None,
             }
         }
         return data
 
+    @staticmethod
+    def to_collection_cursor(query, cursor, per_page, endpoint, order_col,
+                             include_total=False, load_options=(), **kwargs):
+        """Page by seeking on order_col, newest first.
+
+        order_col must be a unique integer column such as the primary key,
+        and cursor must already be converted to that type (e.g. with
+        request.args.get('cursor', type=int)). A string would compare
+        against the integers as text.
+        """
+        page_query = query.options(*load_options).order_by(None).order_by(
+            order_col.desc())
+        if cursor is not None:
+            page_query = page_query.where(order_col < cursor)
+        items = db.session.scalars(page_query.limit(per_page + 1)).all()
+        has_next = len(items) > per_page
+        items = items[:per_page]
+        next_cursor = getattr(items[-1], order_col.key) if has_next else None
+        base_url = url_for(endpoint, per_page=per_page, **kwargs)
+        data = {
+            'items': [item.to_dict() for item in items],
+            'meta': {
+                'cursor': cursor,
+                'next_cursor': next_cursor,
+                'per_page': per_page
+            },
+            '_links': {
+                'self': f'{base_url}&cursor={cursor}'
+                        if cursor is not None else base_url,
+                'next': f'{base_url}&cursor={next_cursor}'
+                        if has_next else None,
+            }
+        }
+        if include_total:
+            data['meta']['total_items'] = fast_count(query)
+        return data
+
 class User(PaginatedAPIMixin, UserMixin, db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     username: so.Mapped[str] = so.mapped_column(sa.String(64), index=True,
                                                                                     unique = True)
     email: so.Mapped[str] = so.mapped_column(sa.String(120), index=True,
                                                                                     unique = True)
+    email_md5: so.Mapped[Optional[str]] = so.mapped_column(sa.String(32))
     password_hash: so.Mapped[Optional[str]] = so.mapped_column(sa.String(256))
     
     posts: so.WriteOnlyMapped['Post'] = so.relationship(back_populates = 'author')
+    read_posts: so.Mapped[list['Post']] = so.relationship(
+        viewonly=True, lazy='raise', order_by='Post.timestamp.desc()')
     
     about_me: so.Mapped[Optional[str]] = so.mapped_column(sa.String(140))
     
-    last_seen: so.Mapped[Optional[datetime]] = so.mapped_column(
-                            default = lambda: datetime.now(timezone.utc))
+    last_seen: so.Mapped[Optional[datetime]]
+    last_seen_iso: so.Mapped[Optional[str]] = so.mapped_column(sa.String(40))
 
     last_message_read_time: so.Mapped[Optional[datetime]]
+
+    follower_count: so.Mapped[int] = so.mapped_column(default=0,
+                                                      server_default='0')
+    following_count: so.Mapped[int] = so.mapped_column(default=0,
+                                                       server_default='0')
+    post_count: so.Mapped[int] = so.mapped_column(default=0,
+                                                  server_default='0')
                         
     following: so.WriteOnlyMapped['User'] = so.relationship(
         secondary=followers, primaryjoin=(followers.c.follower_id == id),
@@ -80,103 +173,158 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
     def __repr__(self):
         return '<User {}>'.format(self.username)     
 
+    @so.validates('email')
+    def validate_email(self, key, email):
+        self.email_md5 = md5(email.lower().encode('utf-8')).hexdigest()
+        return email
+
+    @so.validates('last_seen')
+    def validate_last_seen(self, key, last_seen):
+        self.last_seen_iso = last_seen.replace(
+            tzinfo=timezone.utc).isoformat() if last_seen else None
+        return last_seen
+
     def set_password(self, password):
-        self.password_hash= generate_password_hash(password)
+        self.password_hash = password_hasher.hash(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        if self.password_hash is None:
+            return False
+        if not self.password_hash.startswith('$argon2'):
+            return check_password_hash(self.password_hash, password)
+        try:
+            return password_hasher.verify(self.password_hash, password)
+        except (VerificationError, InvalidHashError):
+            return False
         
     def avatar(self, size):
-        digest = md5(self.email.lower().encode('utf-8')).hexdigest()
-        return f'https://www.gravatar.com/avatar/{digest}?d=identicon&s={size}'
+        return f'https://www.gravatar.com/avatar/{self.email_md5}?d=identicon&s={size}'
 
     def follow(self, user):
         if not self.is_following(user):
             self.following.add(user)
+            self.update_follow_counts(user, 1)
             
     def unfollow(self, user):
         if self.is_following(user):
-            self.following.remove(user)   
+            self.following.remove(user)
+            self.update_follow_counts(user, -1)
+
+    def update_follow_counts(self, user, delta):
+        db.session.execute(
+            sa.update(User).where(User.id == self.id)
+            .values(following_count=User.following_count + delta)
+            .execution_options(synchronize_session=False))
+        db.session.execute(
+            sa.update(User).where(User.id == user.id)
+            .values(follower_count=User.follower_count + delta)
+            .execution_options(synchronize_session=False))
+        db.session.expire(self, ['following_count'])
+        db.session.expire(user, ['follower_count'])
+        forget_user_dict(self.id)
+        forget_user_dict(user.id)
             
     def is_following(self,user):
         query = self.following.select().where(User.id == user.id)
         return db.session.scalar(query) is not None
         
-    def followers_count(self):
-        query = sa.select(sa.func.count()).select_from(
-                self.followers.select().subquery())
-        return db.session.scalar(query)
-        
-    def following_count(self):
-        query = sa.select(sa.func.count()).select_from(
-            self.following.select().subquery())
-        return db.session.scalar(query)
-
     def following_posts(self):
-        Author = so.aliased(User)
-        Follower = so.aliased(User)
+        followed = sa.select(followers.c.followed_id).where(
+            followers.c.follower_id == self.id)
         return (
             sa.select(Post)
-            .join(Post.author.of_type(Author))
-            .join(Author.followers.of_type(Follower), isouter=True)
             .where(sa.or_(
-                    Follower.id == self.id,
-                    Author.id == self.id,
+                    Post.user_id == self.id,
+                    Post.user_id.in_(followed),
                     ))
-            .group_by(Post)
+            .options(so.selectinload(Post.author))
             .order_by(Post.timestamp.desc())
         )
         
     def get_reset_password_token(self, expires_in=600):
-        return jwt.encode({'reset_password': self.id, 'exp': time() + expires_in},
-                             current_app.config['SECRET_KEY'], algorithm='HS256')
-                                        
+        payload = b64url_encode(json.dumps(
+            {'reset_password': self.id, 'exp': time() + expires_in},
+            separators=(',', ':')).encode('utf-8'))
+        signing_input = JWT_HEADER + b'.' + payload
+        signature = hmac.new(current_app.jwt_key, signing_input,
+                             sha256).digest()
+        return (signing_input + b'.' + b64url_encode(signature)).decode('ascii')
+
     @staticmethod
     def verify_reset_password_token(token):
+        if token.count('.') != 2 or len(token) > 512:
+            return
         try:
-            id = jwt.decode(token, current_app.config['SECRET_KEY'],
-                                        algorithms=['HS256'])['reset_password']
-        except:
+            signing_input, signature = token.encode('ascii').rsplit(b'.', 1)
+            header, payload = signing_input.split(b'.')
+            expected = hmac.new(current_app.jwt_key, signing_input,
+                                sha256).digest()
+            if header != JWT_HEADER or not hmac.compare_digest(
+                    b64url_decode(signature), expected):
+                return
+            claims = json.loads(b64url_decode(payload))
+            if claims['exp'] <= time():
+                return
+            id = claims['reset_password']
+        except (ValueError, KeyError, TypeError):
             return
         return db.session.get(User, id)
 
     def unread_message_count(self):
         last_read_time = self.last_message_read_time or datetime(1900, 1, 1)
-        query = sa.select(Message).where(Message.recipient == self,
-                                         Message.timestamp > last_read_time)
-        return db.session.scalar(sa.select(sa.func.count()).select_from(query.subquery()))
+        query = sa.select(sa.func.count()).select_from(Message).where(
+            Message.recipient_id == self.id, Message.timestamp > last_read_time)
+        return db.session.scalar(query)
 
     def add_notification(self, name, data):
-        db.session.execute(self.notifications.delete().where(
-            Notification.name == name))
-        n = Notification(name=name, payload_json=json.dumps(data), user=self)
+        db.session.execute(
+            sa.delete(Notification)
+            .where(Notification.user_id == self.id, Notification.name == name)
+            .execution_options(synchronize_session=False))
+        n = Notification(name=name, payload_json=orjson.dumps(data).decode(),
+                         user=self)
         db.session.add(n)
         return n
-    def posts_count(self):
-        query = sa.select(sa.func.count()).select_from(
-            self.posts.select().subquery())
-        return db.session.scalar(query)
+
+    @staticmethod
+    def refresh_counts():
+        db.session.execute(
+            sa.update(User).values(
+                follower_count=sa.select(sa.func.count())
+                .select_from(followers)
+                .where(followers.c.followed_id == User.id).scalar_subquery(),
+                following_count=sa.select(sa.func.count())
+                .select_from(followers)
+                .where(followers.c.follower_id == User.id).scalar_subquery(),
+                post_count=sa.select(sa.func.count()).select_from(Post)
+                .where(Post.user_id == User.id).scalar_subquery())
+            .execution_options(synchronize_session=False))
 
     def to_dict(self, include_email=False):
-        data = {
-            'id': self.id,
-            'username': self.username,
-            'last_seen': self.last_seen.replace(
-                tzinfo=timezone.utc).isoformat() if self.last_seen else None,
-            'about_me': self.about_me,
-            'post_count': self.posts_count(),
-            'follower_count': self.followers_count(),
-            'following_count': self.following_count(),
-            '_links': {
-                'self': url_for('api.get_user', id=self.id),
-                'followers': url_for('api.get_followers', id=self.id),
-                'following': url_for('api.get_following', id=self.id),
-                'avatar': self.avatar(128)
+        cache = g.setdefault('user_dict_cache', {})
+        key = (self.id, include_email)
+        data = cache.get(key)
+        if data is None:
+            data = {
+                'id': self.id,
+                'username': self.username,
+                'last_seen': self.last_seen_iso,
+                'about_me': self.about_me,
+                'post_count': self.post_count,
+                'follower_count': self.follower_count,
+                'following_count': self.following_count,
+                '_links': {
+                    'self': url_for('api.get_user', id=self.id),
+                    'followers': url_for('api.get_followers', id=self.id),
+                    'following': url_for('api.get_following', id=self.id),
+                    'avatar': self.avatar(128)
+                }
             }
-        }
-        if include_email:
-            data['email'] = self.email
-        return data
+            if include_email:
+                data['email'] = self.email
+            if self.id is not None:
+                cache[key] = data
+        return dict(data, _links=dict(data['_links']))
 
     def from_dict(self, data, new_user=False):
         for field in ['username', 'email', 'about_me']:
@@ -186,6 +334,29 @@ class User(PaginatedAPIMixin, UserMixin, db.Model):
                 self.set_password(data['password'])
 
 
+def forget_user_dict(user_id):
+    if has_app_context():
+        cache = g.get('user_dict_cache', {})
+        cache.pop((user_id, False), None)
+        cache.pop((user_id, True), None)
+
+
+def user_attribute_set(target, value, oldvalue, initiator):
+    identity = sa.inspect(target).identity
+    if identity is not None:
+        forget_user_dict(identity[0])
+
+
+for column in User.__table__.columns.keys():
+    sa.event.listen(getattr(User, column), 'set', user_attribute_set)
+
+
+@sa.event.listens_for(User, 'before_insert')
+def set_initial_last_seen(mapper, connection, target):
+    if target.last_seen is None:
+        target.last_seen = datetime.now(timezone.utc)
+
+
 class Post(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     body: so.Mapped[str] = so.mapped_column(sa.String(140))
@@ -196,10 +367,25 @@ class Post(db.Model):
     author: so.Mapped[User] = so.relationship(back_populates='posts')
     language: so.Mapped[Optional[str]] = so.mapped_column(sa.String(5))
 
+
+@sa.event.listens_for(Post, 'after_insert')
+def increment_post_count(mapper, connection, target):
+    forget_user_dict(target.user_id)
+    connection.execute(sa.update(User).where(User.id == target.user_id)
+                       .values(post_count=User.post_count + 1))
+
+
+@sa.event.listens_for(Post, 'after_delete')
+def decrement_post_count(mapper, connection, target):
+    forget_user_dict(target.user_id)
+    connection.execute(sa.update(User).where(User.id == target.user_id)
+                       .values(post_count=User.post_count - 1))
+
+
 class Message(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     sender_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
-    recipient_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
+    recipient_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     body: so.Mapped[str] = so.mapped_column(sa.String(140))
     timestamp: so.Mapped[datetime] = so.mapped_column(index = True,
                                     default=lambda: datetime.now(timezone.utc))
@@ -207,6 +393,10 @@ class Message(db.Model):
                                               back_populates='messages_sent')
     recipient: so.Mapped[User] = so.relationship(foreign_keys='Message.recipient_id',
                                               back_populates='messages_received')
+
+    __table_args__ = (
+        sa.Index('ix_message_recipient_timestamp', 'recipient_id', 'timestamp'),
+    )
 def __repr__(self):
     return 'f<Post {self.body}>'
 
@@ -217,11 +407,28 @@ def load_user(id):
 class Notification(db.Model):
     id: so.Mapped[int] = so.mapped_column(primary_key=True)
     name: so.Mapped[str] = so.mapped_column(sa.String(128), index = True)
-    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id), index=True)
+    user_id: so.Mapped[int] = so.mapped_column(sa.ForeignKey(User.id))
     timestamp: so.Mapped[float] = so.mapped_column(index=True, default=time)
     payload_json: so.Mapped[str] = so.mapped_column(sa.Text)
     user: so.Mapped[User] = so.relationship(back_populates='notifications')
 
+    __table_args__ = (
+        sa.Index('ix_notification_user_id_name', 'user_id', 'name'),
+    )
+
     def get_data(self):
-        return json.loads(str(self.payload_json))
+        return orjson.loads(self.payload_json)
+
+    @classmethod
+    def bulk_replace(cls, user_notifications):
+        rows = {(user_id, name): {'user_id': user_id, 'name': name,
+                                  'payload_json': orjson.dumps(data).decode()}
+                for user_id, name, data in user_notifications}
+        if not rows:
+            return
+        db.session.execute(
+            sa.delete(cls)
+            .where(sa.tuple_(cls.user_id, cls.name).in_(list(rows)))
+            .execution_options(synchronize_session=False))
+        db.session.execute(sa.insert(cls), list(rows.values()))
 
@@ -0,0 +1,44 @@
+"""user counters
+
+Revision ID: 3c1f9a7e5d42
+Revises: 425fc2244fb6
+Create Date: 2026-10-15 09:12:44.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f9a7e5d42'
+down_revision = '425fc2244fb6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('follower_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('following_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('post_count', sa.Integer(), server_default='0', nullable=False))
+
+    user = sa.table('user', sa.column('id'), sa.column('follower_count'),
+                    sa.column('following_count'), sa.column('post_count'))
+    followers = sa.table('followers', sa.column('follower_id'),
+                         sa.column('followed_id'))
+    post = sa.table('post', sa.column('user_id'))
+    op.execute(user.update().values(
+        follower_count=sa.select(sa.func.count()).select_from(followers)
+        .where(followers.c.followed_id == user.c.id).scalar_subquery(),
+        following_count=sa.select(sa.func.count()).select_from(followers)
+        .where(followers.c.follower_id == user.c.id).scalar_subquery(),
+        post_count=sa.select(sa.func.count()).select_from(post)
+        .where(post.c.user_id == user.c.id).scalar_subquery(),
+    ))
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('post_count')
+        batch_op.drop_column('following_count')
+        batch_op.drop_column('follower_count')
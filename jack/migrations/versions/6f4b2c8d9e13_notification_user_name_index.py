@@ -0,0 +1,28 @@
+"""notification user name index
+
+Revision ID: 6f4b2c8d9e13
+Revises: d5a03e91b7c4
+Create Date: 2026-10-15 12:26:51.804416
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6f4b2c8d9e13'
+down_revision = 'd5a03e91b7c4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.create_index('ix_notification_user_id_name', ['user_id', 'name'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_notification_user_id'))
+
+
+def downgrade():
+    with op.batch_alter_table('notification', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_notification_user_id'), ['user_id'], unique=False)
+        batch_op.drop_index('ix_notification_user_id_name')
@@ -0,0 +1,38 @@
+"""user email md5
+
+Revision ID: 8e2d4b6a0c17
+Revises: 3c1f9a7e5d42
+Create Date: 2026-10-15 10:03:27.552918
+
+"""
+from hashlib import md5
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2d4b6a0c17'
+down_revision = '3c1f9a7e5d42'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('email_md5', sa.String(length=32), nullable=True))
+
+    user = sa.table('user', sa.column('id'), sa.column('email'),
+                    sa.column('email_md5'))
+    connection = op.get_bind()
+    rows = [{'user_id': id,
+             'digest': md5(email.lower().encode('utf-8')).hexdigest()}
+            for id, email in connection.execute(sa.select(user.c.id, user.c.email))]
+    if rows:
+        connection.execute(
+            user.update().where(user.c.id == sa.bindparam('user_id'))
+            .values(email_md5=sa.bindparam('digest')), rows)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('email_md5')
@@ -0,0 +1,41 @@
+"""user last seen iso
+
+Revision ID: a71e3d5f08b6
+Revises: 6f4b2c8d9e13
+Create Date: 2026-10-15 13:08:12.660391
+
+"""
+from datetime import timezone
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a71e3d5f08b6'
+down_revision = '6f4b2c8d9e13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('last_seen_iso', sa.String(length=40), nullable=True))
+
+    user = sa.table('user', sa.column('id'),
+                    sa.column('last_seen', sa.DateTime()),
+                    sa.column('last_seen_iso'))
+    connection = op.get_bind()
+    rows = [{'user_id': id,
+             'iso': last_seen.replace(tzinfo=timezone.utc).isoformat()}
+            for id, last_seen in connection.execute(
+                sa.select(user.c.id, user.c.last_seen)
+                .where(user.c.last_seen.is_not(None)))]
+    if rows:
+        connection.execute(
+            user.update().where(user.c.id == sa.bindparam('user_id'))
+            .values(last_seen_iso=sa.bindparam('iso')), rows)
+
+
+def downgrade():
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_column('last_seen_iso')
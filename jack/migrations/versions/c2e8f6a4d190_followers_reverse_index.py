@@ -0,0 +1,26 @@
+"""followers reverse index
+
+Revision ID: c2e8f6a4d190
+Revises: a71e3d5f08b6
+Create Date: 2026-10-15 13:47:39.215580
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c2e8f6a4d190'
+down_revision = 'a71e3d5f08b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.create_index('ix_followers_followed_follower', ['followed_id', 'follower_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('followers', schema=None) as batch_op:
+        batch_op.drop_index('ix_followers_followed_follower')
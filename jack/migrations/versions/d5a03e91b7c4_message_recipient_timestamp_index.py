@@ -0,0 +1,28 @@
+"""message recipient timestamp index
+
+Revision ID: d5a03e91b7c4
+Revises: 8e2d4b6a0c17
+Create Date: 2026-10-15 10:41:05.127734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd5a03e91b7c4'
+down_revision = '8e2d4b6a0c17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_recipient_timestamp', ['recipient_id', 'timestamp'], unique=False)
+        batch_op.drop_index(batch_op.f('ix_message_recipient_id'))
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_message_recipient_id'), ['recipient_id'], unique=False)
+        batch_op.drop_index('ix_message_recipient_timestamp')
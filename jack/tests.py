@@ -3,8 +3,13 @@ os.environ['DATABASE_URL'] = 'sqlite://'
 
 from datetime import datetime, timezone, timedelta
 import unittest
+from werkzeug.security import generate_password_hash
+import sqlalchemy as sa
+import sqlalchemy.orm as so
+from flask import g
 from app import create_app, db
-from app.models import User, Post
+from app.json_provider import OrjsonProvider
+from app.models import User, Post, Notification, fast_count
 from config import Config
 
 class TestConfig(Config):
@@ -14,7 +19,7 @@ class TestConfig(Config):
 class UserModelCase(unittest.TestCase):
     def setUp(self):
         self.app = create_app(TestConfig)
-        self.app_context = app.app_context()
+        self.app_context = self.app.app_context()
         self.app_context.push()
         db.create_all()
         
@@ -28,12 +33,58 @@ class UserModelCase(unittest.TestCase):
         u.set_password('cat')
         self.assertFalse(u.check_password('dog'))
         self.assertTrue(u.check_password('cat'))
+        self.assertTrue(u.password_hash.startswith('$argon2id$'))
+
+    def test_legacy_password_hash(self):
+        u = User(username='susan', email = 'susan@example.com')
+        u.password_hash = generate_password_hash('cat')
+        self.assertFalse(u.check_password('dog'))
+        self.assertTrue(u.check_password('cat'))
         
     def test_avatar(self):
         u = User(username='john', email = 'john@example.com')
         self.assertEqual(u.avatar(128), ('https://www.gravatar.com/avatar/'
                                                         'd4c74594d841139328695756648b6bd6'
                                                         '?d=identicon&s=128'))
+    def test_reset_password_token(self):
+        u = User(username='john', email = 'john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        token = u.get_reset_password_token()
+        self.assertEqual(User.verify_reset_password_token(token), u)
+        self.assertIsNone(User.verify_reset_password_token(token + 'x'))
+        signing_input, signature = token.rsplit('.', 1)
+        self.assertIsNone(User.verify_reset_password_token(
+            f'{signing_input}.{signature[:10]}!!{signature[10:]}'))
+        self.assertIsNone(User.verify_reset_password_token(
+            f'{signing_input}.{signature}=='))
+        self.assertIsNone(User.verify_reset_password_token('not-a-token'))
+        self.assertIsNone(User.verify_reset_password_token(
+            u.get_reset_password_token(expires_in=-10)))
+
+    def test_last_seen_iso(self):
+        u = User(username='john', email = 'john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        self.assertIsNotNone(u.last_seen)
+        self.assertEqual(u.last_seen_iso,
+                         u.last_seen.replace(tzinfo=timezone.utc).isoformat())
+
+        u.last_seen = datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        db.session.commit()
+        self.assertEqual(u.last_seen_iso, '2026-01-02T03:04:05+00:00')
+        with self.app.test_request_context():
+            self.assertEqual(u.to_dict()['last_seen'],
+                             u.last_seen.replace(tzinfo=timezone.utc).isoformat())
+
+    def test_json_provider(self):
+        self.assertIsInstance(self.app.json, OrjsonProvider)
+        data = {'b': 1, 1: 'x',
+                'a': datetime(2026, 1, 2, 3, 4, 5, tzinfo=timezone.utc)}
+        self.assertEqual(self.app.json.dumps(data),
+                         '{"1":"x","a":"Fri, 02 Jan 2026 03:04:05 GMT","b":1}')
+        self.assertEqual(self.app.json.loads('{"a": [1, 2]}'), {'a': [1, 2]})
+
     def test_follow(self):
         u1 = User(username='john', email = 'john@example.com')
         u2 = User(username='susan', email = 'susan@example.com')
@@ -46,10 +97,12 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(followers, [])
         
         u1.follow(u2)
+        self.assertEqual(u1.following_count, 1)
+        self.assertEqual(u2.follower_count, 1)
         db.session.commit()
         self.assertTrue(u1.is_following(u2))
-        self.assertEqual(u1.following_count(),1)
-        self.assertEqual(u2.followers_count(),1)
+        self.assertEqual(u1.following_count,1)
+        self.assertEqual(u2.follower_count,1)
         u1_following = db.session.scalars(u1.following.select()).all()
         u2_followers = db.session.scalars(u2.followers.select()).all()
         self.assertEqual(u1_following[0].username, 'susan')
@@ -58,8 +111,8 @@ class UserModelCase(unittest.TestCase):
         u1.unfollow(u2)
         db.session.commit()
         self.assertFalse(u1.is_following(u2))
-        self.assertEqual(u1.following_count(),0)
-        self.assertEqual(u2.followers_count(),0)
+        self.assertEqual(u1.following_count,0)
+        self.assertEqual(u2.follower_count,0)
         
     def test_follow_posts(self):
         # create four users
@@ -98,6 +151,167 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(f2, [p2, p3])
         self.assertEqual(f3, [p3, p4])
         self.assertEqual(f4, [p4])
+        for post in f1:
+            self.assertNotIn('author', sa.inspect(post).unloaded)
+
+    def test_post_count(self):
+        u = User(username='john', email = 'john@example.com')
+        db.session.add(u)
+        db.session.commit()
+        self.assertEqual(u.post_count, 0)
+
+        p1 = Post(body = 'first post', author = u)
+        p2 = Post(body = 'second post', author = u)
+        db.session.add_all([p1, p2])
+        db.session.commit()
+        self.assertEqual(u.post_count, 2)
+
+        db.session.delete(p1)
+        db.session.commit()
+        self.assertEqual(u.post_count, 1)
+
+    def test_read_posts(self):
+        u = User(username='john', email = 'john@example.com')
+        db.session.add(u)
+        db.session.add(Post(body = 'post from john', author = u))
+        db.session.commit()
+
+        user = db.session.scalar(sa.select(User))
+        with self.assertRaises(sa.exc.InvalidRequestError):
+            user.read_posts
+        user = db.session.scalar(
+            sa.select(User).options(so.selectinload(User.read_posts)))
+        self.assertEqual([p.body for p in user.read_posts], ['post from john'])
+
+    def test_bulk_replace_notifications(self):
+        u1 = User(username='john', email = 'john@example.com')
+        u2 = User(username='susan', email = 'susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        u1.add_notification('unread_message_count', 3)
+        u1.add_notification('other', 'keep')
+        db.session.commit()
+
+        Notification.bulk_replace([(u1.id, 'unread_message_count', 4),
+                                   (u2.id, 'unread_message_count', 2),
+                                   (u2.id, 'unread_message_count', 1)])
+        db.session.commit()
+        n1 = db.session.scalars(u1.notifications.select().order_by(
+            Notification.name)).all()
+        n2 = db.session.scalars(u2.notifications.select()).all()
+        self.assertEqual([(n.name, n.get_data()) for n in n1],
+                         [('other', 'keep'), ('unread_message_count', 4)])
+        self.assertEqual([(n.name, n.get_data()) for n in n2],
+                         [('unread_message_count', 1)])
+
+    def test_to_collection_dict(self):
+        db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com')
+                            for i in range(3)])
+        db.session.commit()
+        query = sa.select(User).order_by(User.id)
+        with self.app.test_request_context():
+            data = User.to_collection_dict(query, 1, 2, 'api.get_users')
+            self.assertEqual([u['username'] for u in data['items']],
+                             ['user0', 'user1'])
+            self.assertEqual(data['meta']['total_items'], 3)
+            self.assertEqual(data['meta']['total_pages'], 2)
+            self.assertEqual(data['_links']['self'], '/api/users?per_page=2&page=1')
+            self.assertEqual(data['_links']['next'], '/api/users?per_page=2&page=2')
+            self.assertIsNone(data['_links']['prev'])
+
+            data = User.to_collection_dict(query, 2, 2, 'api.get_users')
+            self.assertEqual([u['username'] for u in data['items']], ['user2'])
+            self.assertIsNone(data['_links']['next'])
+            self.assertEqual(data['_links']['prev'], '/api/users?per_page=2&page=1')
+
+            for per_page in (0, -1):
+                data = User.to_collection_dict(query, 1, per_page, 'api.get_users')
+                self.assertEqual(data['meta']['per_page'], 20)
+                self.assertEqual(data['meta']['total_pages'], 1)
+                self.assertEqual(len(data['items']), 3)
+                self.assertIsNone(data['_links']['next'])
+
+        query = sa.select(User).where(User.username.in_(['user0', 'user2']))
+        self.assertEqual(fast_count(query), 2)
+
+    def test_to_collection_cursor(self):
+        db.session.add_all([User(username=f'user{i}', email=f'user{i}@example.com')
+                            for i in range(5)])
+        db.session.commit()
+        query = sa.select(User)
+        with self.app.test_request_context():
+            data = User.to_collection_cursor(query, None, 2, 'api.get_users',
+                                             User.id, include_total=True)
+            self.assertEqual([u['username'] for u in data['items']],
+                             ['user4', 'user3'])
+            self.assertEqual(data['meta']['total_items'], 5)
+            self.assertEqual(data['_links']['self'], '/api/users?per_page=2')
+            cursor = data['meta']['next_cursor']
+            self.assertEqual(data['_links']['next'],
+                             f'/api/users?per_page=2&cursor={cursor}')
+
+            data = User.to_collection_cursor(query, cursor, 2, 'api.get_users',
+                                             User.id)
+            self.assertEqual([u['username'] for u in data['items']],
+                             ['user2', 'user1'])
+            self.assertNotIn('total_items', data['meta'])
+            cursor = data['meta']['next_cursor']
+
+            data = User.to_collection_cursor(query, cursor, 2, 'api.get_users',
+                                             User.id)
+            self.assertEqual([u['username'] for u in data['items']], ['user0'])
+            self.assertIsNone(data['meta']['next_cursor'])
+            self.assertIsNone(data['_links']['next'])
+
+    def test_to_dict_cache(self):
+        u1 = User(username='john', email = 'john@example.com')
+        u2 = User(username='susan', email = 'susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        with self.app.test_request_context():
+            data = u1.to_dict()
+            self.assertIn((u1.id, False), g.user_dict_cache)
+            data['username'] = 'changed'
+            data['_links']['self'] = 'changed'
+            data = u1.to_dict()
+            self.assertEqual(data['username'], 'john')
+            self.assertEqual(data['_links']['self'], f'/api/users/{u1.id}')
+
+            u1.about_me = 'hello'
+            self.assertNotIn((u1.id, False), g.user_dict_cache)
+            self.assertEqual(u1.to_dict()['about_me'], 'hello')
+
+            u2.to_dict()
+            u1.follow(u2)
+            self.assertEqual(u1.to_dict()['following_count'], 1)
+            self.assertEqual(u2.to_dict()['follower_count'], 1)
+            self.app.json.dumps(u1.to_dict())
+            db.session.commit()
+            self.assertEqual(u1.to_dict()['following_count'], 1)
+            self.assertEqual(u2.to_dict()['follower_count'], 1)
+
+            db.session.add(Post(body = 'post from john', author = u1))
+            db.session.commit()
+            self.assertEqual(u1.to_dict()['post_count'], 1)
+
+    def test_refresh_counts(self):
+        u1 = User(username='john', email = 'john@example.com')
+        u2 = User(username='susan', email = 'susan@example.com')
+        db.session.add_all([u1, u2])
+        db.session.add(Post(body = 'post from john', author = u1))
+        db.session.commit()
+        u1.follow(u2)
+        db.session.commit()
+
+        u1.post_count = u1.following_count = u2.follower_count = 5
+        db.session.commit()
+        User.refresh_counts()
+        db.session.commit()
+        self.assertEqual(u1.post_count, 1)
+        self.assertEqual(u1.following_count, 1)
+        self.assertEqual(u1.follower_count, 0)
+        self.assertEqual(u2.follower_count, 1)
+        self.assertEqual(u2.post_count, 0)
         
 if __name__ == '__main__':
     unittest.main(verbosity=2)